@@ -1,43 +1,499 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, deque
+import asyncio
 import os
 import json
-from typing import Dict
+import secrets
+import sys
+import threading
+import time
+import uuid
+from typing import Deque, Dict, List, Optional
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Configuración de la cola de entregas de webhooks
+WEBHOOK_QUEUE_MAXSIZE = int(os.getenv("WEBHOOK_QUEUE_MAXSIZE", "1000"))
+WEBHOOK_WORKERS = max(1, int(os.getenv("WEBHOOK_WORKERS", "4")))
+DELIVERY_ACK_TIMEOUT = float(os.getenv("DELIVERY_ACK_TIMEOUT", "5"))
+DELIVERY_SEND_TIMEOUT = float(os.getenv("DELIVERY_SEND_TIMEOUT", "5"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "3"))
+DELIVERY_MAX_PARKED_PER_SESSION = int(os.getenv("DELIVERY_MAX_PARKED_PER_SESSION", "100"))
+DELIVERY_PARK_TTL = float(os.getenv("DELIVERY_PARK_TTL", "300"))
+DELIVERY_HISTORY_SIZE = int(os.getenv("DELIVERY_HISTORY_SIZE", "5000"))
+
+# Configuración de la superficie de administración (profiling y métricas)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+RESOURCE_ACCOUNTING = os.getenv("RESOURCE_ACCOUNTING", "false").lower() in ("1", "true", "yes")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca los workers de entrega al iniciar y los detiene al apagar"""
+    delivery_queue.start()
+    if manager.accounting_enabled:
+        lag_monitor.start()
+    yield
+    await lag_monitor.stop()
+    await delivery_queue.stop()
+
 # Crear la instancia de FastAPI
-app = FastAPI(title="Tutoria MVP", description="API básica para el MVP de tutoria")
+app = FastAPI(title="Tutoria MVP", description="API básica para el MVP de tutoria", lifespan=lifespan)
 
 # Gestor de conexiones WebSocket
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Contabilidad de recursos por sesión; los hooks sólo miran este flag si está apagada
+        self.accounting_enabled = RESOURCE_ACCOUNTING
+        self.session_stats: Dict[str, dict] = {}
     
     async def connect(self, websocket: WebSocket, session_id: str):
         await websocket.accept()
         self.active_connections[session_id] = websocket
+        if self.accounting_enabled:
+            self.session_stats[session_id] = self._new_stats()
         print(f"🔌 WebSocket conectado para sesión: {session_id}")
     
-    def disconnect(self, session_id: str):
-        if session_id in self.active_connections:
+    def disconnect(self, session_id: str, websocket: WebSocket):
+        # Sólo se borra si es el mismo socket: al reconectar, el cierre del viejo no debe pisar al nuevo
+        if self.active_connections.get(session_id) is websocket:
             del self.active_connections[session_id]
+            self.session_stats.pop(session_id, None)
             print(f"🔌 WebSocket desconectado para sesión: {session_id}")
     
-    async def send_personal_message(self, message: dict, session_id: str):
+    def abort(self, session_id: str):
+        """Da de baja un socket trabado y lo cierra en segundo plano para que el cliente reconecte"""
+        websocket = self.active_connections.get(session_id)
+        if websocket is None:
+            return
+        self.disconnect(session_id, websocket)
+        asyncio.create_task(self._close_quietly(websocket))
+    
+    async def _close_quietly(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    
+    def is_connected(self, session_id: str) -> bool:
+        return session_id in self.active_connections
+    
+    async def send_personal_message(self, message: dict, session_id: str) -> bool:
+        """Envía un mensaje a la sesión. Devuelve True si el socket lo aceptó"""
         if session_id in self.active_connections:
             websocket = self.active_connections[session_id]
             try:
-                await websocket.send_text(json.dumps(message))
+                # Sólo se mide el CPU antes y después del await: mientras send_text
+                # espera al socket corren otras tareas que no son de esta sesión
+                started = time.thread_time() if self.accounting_enabled else None
+                text = json.dumps(message)
+                if started is not None:
+                    cpu_time = time.thread_time() - started
+                await websocket.send_text(text)
+                if started is not None:
+                    started = time.thread_time()
                 print(f"📤 Mensaje enviado a sesión {session_id}: {message}")
+                if started is not None:
+                    self.record_sent(session_id, text, cpu_time + time.thread_time() - started)
+                return True
             except Exception as e:
                 print(f"❌ Error enviando mensaje a {session_id}: {e}")
-                self.disconnect(session_id)
+                self.disconnect(session_id, websocket)
+        return False
+    
+    def set_accounting(self, enabled: bool):
+        """Activa o desactiva la contabilidad por sesión en caliente"""
+        if enabled and not self.accounting_enabled:
+            self.session_stats = {session_id: self._new_stats() for session_id in self.active_connections}
+        elif not enabled:
+            self.session_stats = {}
+        self.accounting_enabled = enabled
+    
+    def record_received(self, session_id: str, data: str, cpu_time: float):
+        """Hook del loop de recepción: sólo se llama con la contabilidad activa"""
+        stats = self.session_stats.get(session_id)
+        if stats is not None:
+            stats["cpu_time"] += cpu_time
+            stats["bytes_in"] += len(data.encode("utf-8"))
+            stats["messages_in"] += 1
+    
+    def record_sent(self, session_id: str, text: str, cpu_time: float):
+        """Hook de envío: sólo se llama con la contabilidad activa y si send_text tuvo éxito"""
+        stats = self.session_stats.get(session_id)
+        if stats is not None:
+            stats["cpu_time"] += cpu_time
+            stats["bytes_out"] += len(text.encode("utf-8"))
+            stats["messages_out"] += 1
+    
+    def record_loop_lag(self, lag: float):
+        for stats in self.session_stats.values():
+            if lag > stats["loop_lag_max"]:
+                stats["loop_lag_max"] = lag
+    
+    def _new_stats(self) -> dict:
+        return {
+            "connected_at": time.time(),
+            "cpu_time": 0.0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "messages_in": 0,
+            "messages_out": 0,
+            "loop_lag_max": 0.0,
+        }
 
 manager = ConnectionManager()
 
+# Cola de entregas asíncronas de comandos al frontend
+class DeliveryQueue:
+    """Desacopla la recepción de webhooks del envío por WebSocket.
+
+    Cada comando recibe un delivery_id y pasa por los estados:
+    queued -> sent -> acked. Si la sesión no está conectada queda "parked"
+    hasta que se reconecte o venza DELIVERY_PARK_TTL; si el cliente no
+    confirma dentro de DELIVERY_ACK_TIMEOUT se reintenta hasta
+    DELIVERY_MAX_ATTEMPTS veces y luego queda "failed".
+
+    Cada sesión se asigna siempre al mismo worker, así los comandos llegan
+    en el orden en que entraron los webhooks. La excepción son los
+    reintentos: un frame sin ack se reenvía después de los que ya salieron.
+    Un envío que tarda más de DELIVERY_SEND_TIMEOUT se corta, el comando
+    vuelve a estacionarse y el socket se cierra para que el cliente
+    reconecte, así un cliente lento no frena al resto de su worker.
+    WEBHOOK_QUEUE_MAXSIZE acota las entregas sin terminar (queued, sent y
+    parked) de todas las sesiones.
+    """
+
+    FINISHED_STATUSES = ("acked", "failed")
+
+    def __init__(self, manager: ConnectionManager):
+        self.manager = manager
+        self.queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(WEBHOOK_WORKERS)]
+        self.deliveries: "OrderedDict[str, dict]" = OrderedDict()
+        self.parked: Dict[str, Deque[str]] = {}
+        self.ack_timers: Dict[str, asyncio.TimerHandle] = {}
+        self.workers: List[asyncio.Task] = []
+        self.unfinished = 0
+    
+    def start(self):
+        for queue in self.queues:
+            self.workers.append(asyncio.create_task(self._worker(queue)))
+        self.workers.append(asyncio.create_task(self._expire_parked_periodically()))
+        print(f"🚚 {WEBHOOK_WORKERS} workers de entrega iniciados")
+    
+    async def stop(self):
+        for timer in self.ack_timers.values():
+            timer.cancel()
+        self.ack_timers.clear()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+    
+    def enqueue(self, session_id: str, message: dict) -> str:
+        """Encola un comando y devuelve su delivery_id. Lanza asyncio.QueueFull si no hay lugar"""
+        if self.unfinished >= WEBHOOK_QUEUE_MAXSIZE:
+            self._expire_parked()
+            if self.unfinished >= WEBHOOK_QUEUE_MAXSIZE:
+                raise asyncio.QueueFull
+        delivery_id = uuid.uuid4().hex
+        now = time.time()
+        self.deliveries[delivery_id] = {
+            "delivery_id": delivery_id,
+            "session_id": session_id,
+            "message": message,
+            "status": "queued",
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+            "error": None,
+        }
+        self.unfinished += 1
+        self._queue_for(session_id).put_nowait(("deliver", delivery_id))
+        self._trim_history()
+        return delivery_id
+    
+    def get(self, delivery_id: str) -> Optional[dict]:
+        return self.deliveries.get(delivery_id)
+    
+    def ack(self, delivery_id: str, session_id: str) -> bool:
+        """Marca una entrega como confirmada por el cliente"""
+        record = self.deliveries.get(delivery_id)
+        if record is None or record["session_id"] != session_id:
+            return False
+        timer = self.ack_timers.pop(delivery_id, None)
+        if timer is not None:
+            timer.cancel()
+        if record["status"] != "acked":
+            self._set_status(record, "acked")
+            print(f"✅ Entrega {delivery_id} confirmada por sesión {session_id}")
+        return True
+    
+    def resume(self, session_id: str):
+        """Pide al worker de la sesión que vacíe, en orden, sus comandos estacionados.
+
+        La cola de estacionados queda en su lugar hasta que el worker la vacía, así
+        los comandos nuevos que lleguen mientras tanto se estacionan detrás.
+        """
+        if self.parked.get(session_id):
+            self._queue_for(session_id).put_nowait(("drain", session_id))
+    
+    def _queue_for(self, session_id: str) -> asyncio.Queue:
+        return self.queues[hash(session_id) % len(self.queues)]
+    
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            kind, key = await queue.get()
+            try:
+                if kind == "drain":
+                    await self._drain(key)
+                else:
+                    await self._deliver(key)
+            except Exception as e:
+                print(f"❌ Error entregando {key}: {e}")
+            finally:
+                queue.task_done()
+    
+    async def _deliver(self, delivery_id: str):
+        record = self.deliveries.get(delivery_id)
+        if record is None or record["status"] != "queued":
+            return
+        session_id = record["session_id"]
+        # Si hay comandos anteriores estacionados, éste va detrás para no adelantarlos
+        if not self.manager.is_connected(session_id) or self.parked.get(session_id):
+            self._park(record)
+            return
+        if not await self._send(record):
+            self._park(record)
+    
+    async def _drain(self, session_id: str):
+        """Envía en orden los comandos estacionados mientras la sesión siga conectada"""
+        while self.manager.is_connected(session_id):
+            pending = self.parked.get(session_id)
+            if not pending:
+                self.parked.pop(session_id, None)
+                return
+            record = self.deliveries.get(pending.popleft())
+            if record is None or record["status"] != "parked":
+                continue
+            self._set_status(record, "queued")
+            if not await self._send(record):
+                self._park(record, front=True)
+                return
+    
+    async def _send(self, record: dict) -> bool:
+        delivery_id = record["delivery_id"]
+        session_id = record["session_id"]
+        record["attempts"] += 1
+        frame = dict(record["message"], delivery_id=delivery_id)
+        try:
+            sent = await asyncio.wait_for(
+                self.manager.send_personal_message(frame, session_id), DELIVERY_SEND_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            print(f"⏰ Envío de {delivery_id} a {session_id} superó {DELIVERY_SEND_TIMEOUT}s, cerrando socket")
+            self.manager.abort(session_id)
+            return False
+        if not sent:
+            return False
+        
+        self._set_status(record, "sent")
+        loop = asyncio.get_running_loop()
+        self.ack_timers[delivery_id] = loop.call_later(
+            DELIVERY_ACK_TIMEOUT, self._on_ack_timeout, delivery_id
+        )
+        return True
+    
+    def _on_ack_timeout(self, delivery_id: str):
+        self.ack_timers.pop(delivery_id, None)
+        record = self.deliveries.get(delivery_id)
+        if record is None or record["status"] != "sent":
+            return
+        if record["attempts"] >= DELIVERY_MAX_ATTEMPTS:
+            self._set_status(record, "failed", f"sin ack tras {record['attempts']} intentos")
+            print(f"❌ Entrega {delivery_id} fallida: sin ack del cliente")
+            return
+        self._set_status(record, "queued")
+        self._queue_for(record["session_id"]).put_nowait(("deliver", delivery_id))
+    
+    def _park(self, record: dict, front: bool = False):
+        session_id = record["session_id"]
+        pending = self.parked.setdefault(session_id, deque())
+        if front:
+            # Un comando que falló al vaciar la cola vuelve a la cabeza para no perder el orden
+            pending.appendleft(record["delivery_id"])
+        else:
+            if len(pending) >= DELIVERY_MAX_PARKED_PER_SESSION:
+                dropped = self.deliveries.get(pending.popleft())
+                if dropped is not None:
+                    self._set_status(dropped, "failed", "demasiadas entregas estacionadas")
+            pending.append(record["delivery_id"])
+        self._set_status(record, "parked")
+        print(f"🅿️ Entrega {record['delivery_id']} estacionada hasta que {session_id} se conecte")
+    
+    async def _expire_parked_periodically(self):
+        while True:
+            await asyncio.sleep(min(DELIVERY_PARK_TTL, 30))
+            self._expire_parked()
+    
+    def _expire_parked(self):
+        """Marca como failed las entregas estacionadas más de DELIVERY_PARK_TTL"""
+        deadline = time.time() - DELIVERY_PARK_TTL
+        for session_id, pending in list(self.parked.items()):
+            # Cada deque está ordenada por momento de estacionamiento
+            while pending:
+                record = self.deliveries.get(pending[0])
+                if record is not None and record["status"] == "parked":
+                    if record["updated_at"] > deadline:
+                        break
+                    self._set_status(record, "failed", "la sesión no se conectó a tiempo")
+                pending.popleft()
+            if not pending:
+                del self.parked[session_id]
+    
+    def _set_status(self, record: dict, status: str, error: Optional[str] = None):
+        if record["status"] not in self.FINISHED_STATUSES and status in self.FINISHED_STATUSES:
+            self.unfinished -= 1
+        record["status"] = status
+        record["error"] = error
+        record["updated_at"] = time.time()
+    
+    def _trim_history(self):
+        """Olvida las entregas terminadas más viejas para acotar la memoria"""
+        if len(self.deliveries) <= DELIVERY_HISTORY_SIZE:
+            return
+        for delivery_id in list(self.deliveries):
+            if len(self.deliveries) <= DELIVERY_HISTORY_SIZE:
+                break
+            if self.deliveries[delivery_id]["status"] in self.FINISHED_STATUSES:
+                del self.deliveries[delivery_id]
+
+delivery_queue = DeliveryQueue(manager)
+
+# Medición del retraso (lag) del event loop
+class LoopLagMonitor:
+    """Duerme LOOP_LAG_INTERVAL y mide cuánto tarda de más en despertar.
+
+    Un lag alto significa que algo está bloqueando el event loop. Sólo corre
+    mientras la contabilidad de recursos está activa.
+    """
+
+    def __init__(self, manager: ConnectionManager, interval: float):
+        self.manager = manager
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.reset()
+    
+    def reset(self):
+        self.last = 0.0
+        self.max = 0.0
+        self.avg = 0.0
+        self.samples = 0
+    
+    def start(self):
+        if self.task is None:
+            self.reset()
+            self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+    
+    def snapshot(self) -> dict:
+        return {
+            "running": self.task is not None,
+            "interval": self.interval,
+            "last": self.last,
+            "max": self.max,
+            "avg": self.avg,
+            "samples": self.samples,
+        }
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.samples += 1
+            self.last = lag
+            self.max = max(self.max, lag)
+            # Media móvil exponencial para suavizar picos aislados
+            self.avg = lag if self.samples == 1 else self.avg * 0.9 + lag * 0.1
+            self.manager.record_loop_lag(lag)
+
+lag_monitor = LoopLagMonitor(manager, LOOP_LAG_INTERVAL)
+
+# Profiler por muestreo del hilo del event loop
+class StackSampler:
+    """Toma muestras periódicas del stack de un hilo desde un hilo aparte.
+
+    No instrumenta el código: cada interval segundos lee el frame actual del
+    hilo objetivo con sys._current_frames() y cuenta el stack colapsado
+    ("raiz;...;hoja"), el mismo formato que consumen las herramientas de
+    flamegraphs.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+    
+    def flamegraph(self) -> dict:
+        """Árbol {name, value, children} compatible con d3-flame-graph"""
+        root = {"name": "root", "value": 0, "children": {}}
+        for stack, count in self.stacks.items():
+            root["value"] += count
+            node = root
+            for frame in stack.split(";"):
+                node = node["children"].setdefault(frame, {"name": frame, "value": 0, "children": {}})
+                node["value"] += count
+        return self._freeze(root)
+    
+    def _freeze(self, node: dict) -> dict:
+        return {
+            "name": node["name"],
+            "value": node["value"],
+            "children": [self._freeze(child) for child in node["children"].values()],
+        }
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            names.reverse()
+            self.stacks[";".join(names)] += 1
+            self.samples += 1
+
+profile_lock = asyncio.Lock()
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -61,35 +517,86 @@ async def health_check():
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """Endpoint WebSocket para comunicación en tiempo real"""
     await manager.connect(websocket, session_id)
+    # Reenviar los comandos que llegaron mientras la sesión estaba desconectada
+    delivery_queue.resume(session_id)
     try:
         while True:
             data = await websocket.receive_text()
+            started = time.thread_time() if manager.accounting_enabled else None
+            # Confirmaciones de entrega: {"type": "ack", "delivery_id": "..."}
+            ack = parse_ack(data)
+            if ack is not None:
+                delivery_queue.ack(ack, session_id)
+            if started is not None:
+                # El envío del echo lo contabiliza send_personal_message
+                manager.record_received(session_id, data, time.thread_time() - started)
+            if ack is not None:
+                continue
             # Echo del mensaje recibido (para pruebas)
             await manager.send_personal_message({"echo": data}, session_id)
     except WebSocketDisconnect:
-        manager.disconnect(session_id)
+        manager.disconnect(session_id, websocket)
+
+def parse_ack(data: str) -> Optional[str]:
+    """Devuelve el delivery_id si el frame es un ack, o None en otro caso"""
+    if not data.startswith("{"):
+        return None
+    try:
+        frame = json.loads(data)
+    except ValueError:
+        return None
+    if isinstance(frame, dict) and frame.get("type") == "ack" and isinstance(frame.get("delivery_id"), str):
+        return frame["delivery_id"]
+    return None
+
+def accept_delivery(session_id: str, message: dict) -> JSONResponse:
+    """Encola un comando para la sesión y responde 202 con su delivery_id"""
+    try:
+        delivery_id = delivery_queue.enqueue(session_id, message)
+    except asyncio.QueueFull:
+        return JSONResponse(status_code=503, content={"error": "Cola de entregas llena, reintentar más tarde"})
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "delivery_id": delivery_id,
+        "status_url": f"/api/v1/deliveries/{delivery_id}",
+    })
 
 @app.post("/api/v1/webhook/openai")
 async def openai_webhook(request_data: dict):
-    """Webhook para recibir tool calls de OpenAI y enviarlos al frontend"""
+    """Webhook para recibir tool calls de OpenAI y encolarlos para el frontend"""
     try:
         # Extraer session_id y tool_call del request
         session_id = request_data.get("session_id")
         tool_call = request_data.get("tool_call")
         
         if not session_id or not tool_call:
-            return {"error": "session_id y tool_call son requeridos"}, 400
+            return JSONResponse(status_code=400, content={"error": "session_id y tool_call son requeridos"})
+        
+        if not isinstance(session_id, str) or not isinstance(tool_call, dict):
+            return JSONResponse(status_code=400, content={"error": "session_id debe ser string y tool_call un objeto"})
         
-        # Enviar el comando de dibujo al frontend
-        await manager.send_personal_message({
-            "cmd": tool_call.get("function", {}).get("name"),
-            "args": json.loads(tool_call.get("function", {}).get("arguments", "{}"))
-        }, session_id)
+        function = tool_call.get("function")
+        if not isinstance(function, dict):
+            return JSONResponse(status_code=400, content={"error": "tool_call.function debe ser un objeto"})
+        name = function.get("name")
+        if not isinstance(name, str) or not name:
+            return JSONResponse(status_code=400, content={"error": "tool_call.function.name es requerido"})
+        arguments = function.get("arguments", "{}")
+        if not isinstance(arguments, str):
+            return JSONResponse(status_code=400, content={"error": "tool_call.function.arguments debe ser un string JSON"})
+        try:
+            args = json.loads(arguments)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": f"arguments no es JSON válido: {e}"})
         
-        return {"status": "success"}
+        # Encolar el comando de dibujo para el frontend
+        return accept_delivery(session_id, {
+            "cmd": name,
+            "args": args
+        })
     except Exception as e:
         print(f"❌ Error en webhook: {e}")
-        return {"error": str(e)}, 500
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.post("/api/v1/test/draw")
 async def test_draw_command(request_data: dict):
@@ -100,18 +607,96 @@ async def test_draw_command(request_data: dict):
         args = request_data.get("args", {})
         
         if not session_id or not command:
-            return {"error": "session_id y command son requeridos"}, 400
+            return JSONResponse(status_code=400, content={"error": "session_id y command son requeridos"})
+        
+        if not isinstance(session_id, str) or not isinstance(command, str):
+            return JSONResponse(status_code=400, content={"error": "session_id y command deben ser strings"})
         
-        # Enviar comando al frontend
-        await manager.send_personal_message({
+        # Encolar comando para el frontend
+        return accept_delivery(session_id, {
             "cmd": command,
             "args": args
-        }, session_id)
-        
-        return {"status": "success", "message": f"Comando {command} enviado a sesión {session_id}"}
+        })
     except Exception as e:
         print(f"❌ Error en test draw: {e}")
-        return {"error": str(e)}, 500
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/api/v1/deliveries/{delivery_id}")
+async def delivery_status(delivery_id: str):
+    """Endpoint para consultar el estado de una entrega encolada"""
+    record = delivery_queue.get(delivery_id)
+    if record is None:
+        return JSONResponse(status_code=404, content={"error": f"Entrega {delivery_id} no encontrada"})
+    status = {key: value for key, value in record.items() if key != "message"}
+    status["cmd"] = record["message"].get("cmd")
+    return status
+
+def check_admin(token: Optional[str]) -> Optional[JSONResponse]:
+    """Valida el header X-Admin-Token. Sin ADMIN_TOKEN configurado la administración está deshabilitada"""
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "Administración deshabilitada (configurar ADMIN_TOKEN)"})
+    if not token or not secrets.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return JSONResponse(status_code=401, content={"error": "X-Admin-Token inválido"})
+    return None
+
+@app.post("/api/v1/admin/profile")
+async def admin_profile(seconds: float = 5, format: str = "collapsed", interval_ms: float = 5,
+                        x_admin_token: Optional[str] = Header(None)):
+    """Perfila el event loop por muestreo durante N segundos y devuelve stacks colapsados o un flamegraph"""
+    denied = check_admin(x_admin_token)
+    if denied:
+        return denied
+    if format not in ("collapsed", "flamegraph"):
+        return JSONResponse(status_code=400, content={"error": "format debe ser collapsed o flamegraph"})
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return JSONResponse(status_code=400, content={"error": f"seconds debe estar entre 0 y {PROFILE_MAX_SECONDS}"})
+    if not 1 <= interval_ms <= 1000:
+        return JSONResponse(status_code=400, content={"error": "interval_ms debe estar entre 1 y 1000"})
+    if profile_lock.locked():
+        return JSONResponse(status_code=409, content={"error": "Ya hay un profile en curso"})
+    
+    async with profile_lock:
+        # Este handler corre en el hilo del event loop: ese es el hilo a muestrear
+        sampler = StackSampler(threading.get_ident(), interval_ms / 1000)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+    
+    print(f"🔥 Profile de {seconds}s completado con {sampler.samples} muestras")
+    if format == "flamegraph":
+        return {"seconds": seconds, "samples": sampler.samples, "flamegraph": sampler.flamegraph()}
+    return PlainTextResponse(sampler.collapsed())
+
+@app.get("/api/v1/admin/sessions")
+async def admin_sessions(x_admin_token: Optional[str] = Header(None)):
+    """Métricas de recursos por sesión: CPU, bytes, mensajes y lag del event loop"""
+    denied = check_admin(x_admin_token)
+    if denied:
+        return denied
+    return {
+        "accounting_enabled": manager.accounting_enabled,
+        "loop_lag": lag_monitor.snapshot(),
+        "sessions": manager.session_stats,
+    }
+
+@app.post("/api/v1/admin/accounting")
+async def admin_accounting(request_data: dict, x_admin_token: Optional[str] = Header(None)):
+    """Activa o desactiva la contabilidad por sesión y el monitor de lag"""
+    denied = check_admin(x_admin_token)
+    if denied:
+        return denied
+    enabled = request_data.get("enabled")
+    if not isinstance(enabled, bool):
+        return JSONResponse(status_code=400, content={"error": "enabled (bool) es requerido"})
+    
+    manager.set_accounting(enabled)
+    if enabled:
+        lag_monitor.start()
+    else:
+        await lag_monitor.stop()
+    return {"accounting_enabled": manager.accounting_enabled}
 
 @app.get("/api/v1/session/initiate")
 async def initiate_session():
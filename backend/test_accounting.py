@@ -0,0 +1,123 @@
+"""
+Pruebas de la contabilidad por sesión y de las herramientas de profiling
+"""
+import asyncio
+import threading
+import time
+
+import main
+from test_delivery import FakeWebSocket, run
+
+
+def test_set_accounting_on_and_off():
+    async def scenario():
+        manager = main.ConnectionManager()
+        manager.set_accounting(False)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "s1")
+        await manager.send_personal_message({"cmd": "draw"}, "s1")
+        assert manager.session_stats == {}
+
+        manager.set_accounting(True)
+        assert manager.session_stats["s1"]["messages_out"] == 0
+        await manager.send_personal_message({"cmd": "draw"}, "s1")
+        assert manager.session_stats["s1"]["messages_out"] == 1
+        assert manager.session_stats["s1"]["bytes_out"] > 0
+
+        manager.set_accounting(False)
+        assert manager.session_stats == {}
+
+    run(scenario())
+
+
+def test_empty_frames_are_counted():
+    manager = main.ConnectionManager()
+    manager.set_accounting(True)
+    manager.session_stats["s1"] = manager._new_stats()
+
+    for data in ('{"type": "ack", "delivery_id": "x"}', "", "hi"):
+        manager.record_received("s1", data, 0.0)
+
+    assert manager.session_stats["s1"]["messages_in"] == 3
+    assert manager.session_stats["s1"]["bytes_in"] == len('{"type": "ack", "delivery_id": "x"}') + 2
+
+
+def test_slow_send_is_not_charged_for_other_tasks_cpu():
+    async def burn(seconds: float):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0)
+
+    async def scenario():
+        manager = main.ConnectionManager()
+        manager.set_accounting(True)
+        await manager.connect(FakeWebSocket(send_delay=0.3), "s1")
+        await asyncio.gather(
+            manager.send_personal_message({"cmd": "draw"}, "s1"),
+            burn(0.3),
+        )
+        return manager.session_stats["s1"]["cpu_time"]
+
+    assert run(scenario()) < 0.05
+
+
+def test_failed_send_is_not_counted():
+    class BrokenWebSocket(FakeWebSocket):
+        async def send_text(self, text: str):
+            raise RuntimeError("socket cerrado")
+
+    async def scenario():
+        manager = main.ConnectionManager()
+        manager.set_accounting(True)
+        await manager.connect(BrokenWebSocket(), "s1")
+        stats = manager.session_stats["s1"]
+        assert not await manager.send_personal_message({"cmd": "draw"}, "s1")
+        assert stats["messages_out"] == 0
+        assert stats["bytes_out"] == 0
+
+    run(scenario())
+
+
+def test_check_admin_rejects_non_ascii_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secreto")
+
+    assert main.check_admin("secreto") is None
+    assert main.check_admin("t\xf6k").status_code == 401
+    assert main.check_admin(None).status_code == 401
+
+
+def test_loop_lag_monitor_sees_blocked_loop():
+    async def scenario():
+        monitor = main.LoopLagMonitor(main.ConnectionManager(), 0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+        return monitor.snapshot()
+
+    snapshot = run(scenario())
+    assert snapshot["max"] >= 0.05
+    assert not snapshot["running"]
+
+
+def test_stack_sampler_collapses_target_thread():
+    done = threading.Event()
+
+    def busy_target():
+        while not done.is_set():
+            pass
+
+    target = threading.Thread(target=busy_target)
+    target.start()
+    sampler = main.StackSampler(target.ident, 0.001)
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    done.set()
+    target.join()
+
+    assert sampler.samples > 0
+    assert "busy_target" in sampler.collapsed()
+    tree = sampler.flamegraph()
+    assert tree["value"] == sampler.samples
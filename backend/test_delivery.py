@@ -0,0 +1,185 @@
+"""
+Pruebas de la cola de entregas asíncronas (DeliveryQueue)
+"""
+import asyncio
+import json
+
+import main
+
+
+class FakeWebSocket:
+    """WebSocket mínimo que guarda los frames enviados"""
+
+    def __init__(self, send_delay: float = 0):
+        self.send_delay = send_delay
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+    def cmds(self):
+        return [frame["cmd"] for frame in self.sent]
+
+
+async def settle():
+    """Deja correr a los workers hasta que no quede nada pendiente"""
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_queue():
+    manager = main.ConnectionManager()
+    return manager, main.DeliveryQueue(manager)
+
+
+def test_parked_commands_resume_in_order():
+    async def scenario():
+        manager, queue = make_queue()
+        queue.start()
+        try:
+            first = queue.enqueue("s1", {"cmd": "clear", "args": {}})
+            await settle()
+            assert queue.get(first)["status"] == "parked"
+
+            # Llega otro comando y la sesión se conecta antes de que el worker lo procese
+            queue.enqueue("s1", {"cmd": "draw", "args": {}})
+            websocket = FakeWebSocket()
+            await manager.connect(websocket, "s1")
+            queue.resume("s1")
+            await settle()
+
+            assert websocket.cmds() == ["clear", "draw"]
+            assert "s1" not in queue.parked
+        finally:
+            await queue.stop()
+
+    run(scenario())
+
+
+def test_slow_socket_does_not_block_other_sessions(monkeypatch):
+    monkeypatch.setattr(main, "WEBHOOK_WORKERS", 1)
+    monkeypatch.setattr(main, "DELIVERY_SEND_TIMEOUT", 0.05)
+
+    async def scenario():
+        manager, queue = make_queue()
+        slow, fast = FakeWebSocket(send_delay=10), FakeWebSocket()
+        await manager.connect(slow, "a")
+        await manager.connect(fast, "b")
+        queue.start()
+        try:
+            stalled = queue.enqueue("a", {"cmd": "draw", "args": {}})
+            queue.enqueue("b", {"cmd": "draw", "args": {}})
+            await asyncio.sleep(0.2)
+
+            assert fast.cmds() == ["draw"]
+            assert queue.get(stalled)["status"] == "parked"
+            assert not manager.is_connected("a")
+            assert slow.closed_with == 1011
+        finally:
+            await queue.stop()
+
+    run(scenario())
+
+
+def test_unacked_delivery_is_retried_then_failed(monkeypatch):
+    monkeypatch.setattr(main, "DELIVERY_ACK_TIMEOUT", 0.01)
+    monkeypatch.setattr(main, "DELIVERY_MAX_ATTEMPTS", 2)
+
+    async def scenario():
+        manager, queue = make_queue()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "s1")
+        queue.start()
+        try:
+            delivery_id = queue.enqueue("s1", {"cmd": "draw", "args": {}})
+            await asyncio.sleep(0.1)
+
+            record = queue.get(delivery_id)
+            assert record["status"] == "failed"
+            assert record["attempts"] == 2
+            assert websocket.cmds() == ["draw", "draw"]
+            assert queue.unfinished == 0
+        finally:
+            await queue.stop()
+
+    run(scenario())
+
+
+def test_ack_marks_delivery_acked():
+    async def scenario():
+        manager, queue = make_queue()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, "s1")
+        queue.start()
+        try:
+            delivery_id = queue.enqueue("s1", {"cmd": "draw", "args": {}})
+            await settle()
+
+            assert not queue.ack(delivery_id, "otra-sesion")
+            assert queue.ack(delivery_id, "s1")
+            assert queue.get(delivery_id)["status"] == "acked"
+            assert delivery_id not in queue.ack_timers
+        finally:
+            await queue.stop()
+
+    run(scenario())
+
+
+def test_accept_delivery_returns_503_when_full(monkeypatch):
+    monkeypatch.setattr(main, "WEBHOOK_QUEUE_MAXSIZE", 2)
+    monkeypatch.setattr(main, "delivery_queue", main.DeliveryQueue(main.ConnectionManager()))
+
+    assert main.accept_delivery("s1", {"cmd": "draw", "args": {}}).status_code == 202
+    assert main.accept_delivery("s2", {"cmd": "draw", "args": {}}).status_code == 202
+    assert main.accept_delivery("s3", {"cmd": "draw", "args": {}}).status_code == 503
+
+
+def test_expired_parked_deliveries_free_capacity(monkeypatch):
+    monkeypatch.setattr(main, "WEBHOOK_QUEUE_MAXSIZE", 1)
+    monkeypatch.setattr(main, "DELIVERY_PARK_TTL", 0)
+
+    async def scenario():
+        manager, queue = make_queue()
+        queue.start()
+        try:
+            expired = queue.enqueue("s1", {"cmd": "draw", "args": {}})
+            await settle()
+            queue.enqueue("s2", {"cmd": "draw", "args": {}})
+
+            assert queue.get(expired)["status"] == "failed"
+            assert "s1" not in queue.parked
+        finally:
+            await queue.stop()
+
+    run(scenario())
+
+
+def test_stale_disconnect_keeps_new_connection():
+    async def scenario():
+        manager = main.ConnectionManager()
+        old, new = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(old, "s1")
+        await manager.connect(new, "s1")
+
+        manager.disconnect("s1", old)
+        assert manager.active_connections["s1"] is new
+
+    run(scenario())
+
+
+def test_webhook_requires_function_name():
+    response = run(main.openai_webhook({"session_id": "s1", "tool_call": {"function": {"arguments": "{}"}}}))
+    assert response.status_code == 400
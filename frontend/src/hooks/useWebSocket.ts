@@ -4,6 +4,7 @@ interface WebSocketMessage {
   cmd?: string;
   args?: any;
   echo?: string;
+  delivery_id?: string;
   [key: string]: any;
 }
 
@@ -16,8 +17,10 @@ export const useWebSocket = (sessionId: string) => {
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const reconnectAttempts = useRef(0);
   const maxReconnectAttempts = 3;
+  const maxSeenDeliveryIds = 500;
   const isConnectingRef = useRef(false);
   const lastSessionIdRef = useRef<string>('');
+  const seenDeliveryIdsRef = useRef<Set<string>>(new Set());
 
   const connectWebSocket = () => {
     // Prevent multiple simultaneous connection attempts
@@ -32,6 +35,7 @@ export const useWebSocket = (sessionId: string) => {
       if (wsRef.current) {
         wsRef.current.close(1000, 'SessionId changed');
       }
+      seenDeliveryIdsRef.current.clear();
     }
 
     try {
@@ -68,6 +72,22 @@ export const useWebSocket = (sessionId: string) => {
         try {
           const message = JSON.parse(event.data);
           console.log('📨 Mensaje recibido:', message);
+          if (message.delivery_id) {
+            // Confirmar la entrega; el backend reintenta los comandos sin ack
+            ws.send(JSON.stringify({ type: 'ack', delivery_id: message.delivery_id }));
+            if (seenDeliveryIdsRef.current.has(message.delivery_id)) {
+              console.log('🔁 Comando duplicado ignorado:', message.delivery_id);
+              return;
+            }
+            seenDeliveryIdsRef.current.add(message.delivery_id);
+            // Los reintentos llegan poco después del original: alcanza con recordar los últimos N
+            if (seenDeliveryIdsRef.current.size > maxSeenDeliveryIds) {
+              const oldest = seenDeliveryIdsRef.current.values().next().value;
+              if (oldest !== undefined) {
+                seenDeliveryIdsRef.current.delete(oldest);
+              }
+            }
+          }
           setLastMessage(message);
         } catch (e) {
           console.error('❌ Error parseando mensaje WebSocket:', e);